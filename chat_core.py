@@ -0,0 +1,568 @@
+import os
+import re
+import json
+import uuid
+import hashlib
+import atexit
+import logging
+import random
+import asyncio
+import textwrap
+import importlib.util
+from dataclasses import dataclass
+from typing import Optional
+import httpx
+from groq import Groq, AsyncGroq, APIStatusError, RateLimitError
+
+# Shared building blocks for the assistant modules (llm, chat_history,
+# evaluation, function_calling), which import them with `from chat_core import *`.
+__all__ = [
+    "DEFAULT_MODEL",
+    "CODING_ASSISTANT_SYSTEM_PROMPT",
+    "SYSTEM_PROMPT_TOKEN_COUNT",
+    "OFF_TOPIC_REFUSAL",
+    "GROQ_QPM",
+    "GROQ_MAX_CONCURRENCY",
+    "MAX_PROMPT_TOKENS",
+    "Msg",
+    "ChatLog",
+    "looks_coding_related",
+    "count_tokens",
+    "trim_history",
+    "filter_messages_for_api",
+    "get_groq_client",
+    "get_async_groq_client",
+    "run_with_concurrency",
+]
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# tiktoken gives a close token count for budgeting (cl100k_base is not Llama's
+# tokenizer, but near enough); without it we estimate about 4 characters per token.
+try:
+    import tiktoken
+    _enc = tiktoken.get_encoding("cl100k_base")
+except Exception:
+    _enc = None
+
+# It's good practice to define constants for model names
+# and other configurations.
+DEFAULT_MODEL = "llama3-8b-8192"
+
+# System prompt defining the AI's role and behavior.
+# Every module imports this one constant so the system message is byte-identical
+# on every request; Groq caches identical prompt prefixes, and any change here
+# (even whitespace) invalidates that cache. Add per-feature instructions as a
+# separate message after this one instead of editing it.
+_RAW_CODING_ASSISTANT_SYSTEM_PROMPT = """
+    You are a specialized Coding Assistant AI. Your primary goal is to assist users with their coding-related questions.
+    You must strictly adhere to the following guidelines:
+    1.  **Scope of Assistance:** Only answer questions directly related to programming, software development, algorithms, data structures, coding tools (IDEs, compilers, debuggers, version control), APIs, SDKs, and software architecture.
+    2.  **Refusal for Off-Topic Questions:** If a user asks a question outside this scope (e.g., about history, biology, general knowledge, opinions, personal advice), you MUST politely refuse to answer. You can say something like: "I am a specialized coding assistant and cannot answer questions outside of programming topics." or "My apologies, but I'm programmed to assist with coding-related queries only." Do NOT attempt to answer off-topic questions.
+    3.  **Accuracy and Clarity:** Provide accurate, clear, and concise explanations. If you provide code snippets, ensure they are correct and well-explained.
+    4.  **No Personal Opinions:** Do not express personal opinions or engage in speculative discussions.
+    5.  **Professional Tone:** Maintain a professional and helpful tone at all times.
+"""
+# Normalized once at import: dedented, runs of spaces/tabs collapsed, ends stripped.
+# This sends fewer tokens on every request and fixes the exact bytes of the prompt.
+CODING_ASSISTANT_SYSTEM_PROMPT = re.sub(r"[ \t]+", " ", textwrap.dedent(_RAW_CODING_ASSISTANT_SYSTEM_PROMPT)).strip()
+
+# Canned answer for queries that are obviously off-topic; matches the refusal
+# the system prompt asks the model to give.
+OFF_TOPIC_REFUSAL = "My apologies, but I'm programmed to assist with coding-related queries only."
+
+# Cheap gate run before calling the API. A coding term means the query goes to
+# the model. Only a query that is, as a whole, one of a few off-topic question
+# templates gets the canned refusal without a network call: a single off-topic
+# word is not enough ("build a weather app" is a coding question). Anything else
+# is left for the model to decide.
+_gate_log = logging.getLogger("chat_core.gate")
+_CODING_TERMS = re.compile(
+    r"\b(python|javascript|typescript|java|kotlin|swift|rust|golang|ruby|php|perl|scala|haskell|"
+    r"sql|html|css|json|yaml|xml|regex|bash|shell|linux|docker|kubernetes|git|github|"
+    r"code|coding|program|programming|programmer|software|developer|function|method|class|object|"
+    r"variable|loop|recursion|array|list|dict|dictionary|string|integer|pointer|struct|"
+    r"algorithm|data structure|complexity|big-o|api|sdk|library|framework|package|module|"
+    r"compile|compiler|interpreter|runtime|debug|debugger|bug|exception|stack trace|"
+    r"ide|vscode|vim|database|query|server|frontend|backend|async|thread|decorator|"
+    r"app|build|implement|parse|parser|scrape|scraper|script|generator)\b"
+    r"|c\+\+|c#|\.py\b|\.js\b",
+    re.IGNORECASE,
+)
+_OFF_TOPIC_QUERIES = re.compile(
+    r"(?:what(?:'s| is)|how(?:'s| is)) the weather(?: like)?(?: (?:today|tomorrow|this week|now))?(?: in [\w .'-]+)?"
+    r"|what(?:'s| is) the (?:weather )?forecast(?: for [\w .'-]+)?"
+    r"|what(?:'s| is) the capital (?:city )?of [\w .'-]+"
+    r"|who (?:is|was) the (?:current )?(?:president|prime minister) of [\w .'-]+"
+    r"|who won the [\w .'-]+ (?:game|match|cup|final|election)"
+    r"|(?:give me|suggest|what(?:'s| is)) (?:a |an |the )?(?:good |easy |quick )?recipe for [\w .'-]+"
+    r"|(?:recommend|suggest) (?:me )?(?:a |some )?(?:good )?(?:movies?|films?|songs?)(?: to watch| to listen to)?"
+    r"|(?:what(?:'s| is)|tell me) (?:my |today's )?horoscope(?: for [\w .'-]+)?"
+    r"|(?:write|compose) (?:me )?an? (?:poem|song|haiku)(?: about [\w .'-]+)?",
+    re.IGNORECASE,
+)
+
+def looks_coding_related(query: str):
+    """
+    Quick local guess at whether a query is coding-related.
+    Returns True (coding term found), False (the whole query is an off-topic
+    template, e.g. "What's the weather in Paris?") or None (unsure; let the model decide).
+    Decisions are logged at DEBUG level (logger 'chat_core.gate') to help tune the word lists;
+    they are not printed, since callers stream the answer to stdout.
+    """
+    match = _CODING_TERMS.search(query)
+    if match:
+        decision = True
+    else:
+        match = _OFF_TOPIC_QUERIES.fullmatch(query.strip().rstrip("?!. "))
+        decision = False if match else None
+    _gate_log.debug("decision=%s term=%r query=%r", decision, match.group(0) if match else None, query)
+    return decision
+
+# Unlike a local server (e.g., Ollama's OLLAMA_NUM_PARALLEL), Groq has no
+# server-side parallelism setting to tune: how many requests can usefully be in
+# flight is bounded by your account's rate limits (requests and tokens per
+# minute). Throttle concurrency on the client side to stay under them:
+# GROQ_QPM is the request-per-minute budget and GROQ_MAX_CONCURRENCY the number
+# of requests allowed in flight at once (see run_with_concurrency).
+GROQ_QPM = int(os.environ.get("GROQ_QPM", "500"))
+GROQ_MAX_CONCURRENCY = int(os.environ.get("GROQ_MAX_CONCURRENCY", "16"))
+
+# One HTTP connection pool shared by every async client in the process, so
+# requests reuse kept-alive connections instead of paying a TCP + TLS handshake
+# each time. HTTP/2 (which multiplexes concurrent requests over one connection)
+# needs the optional 'h2' package; without it the pool falls back to HTTP/1.1.
+_shared_http = httpx.AsyncClient(
+    http2=importlib.util.find_spec("h2") is not None,
+    limits=httpx.Limits(max_connections=100, max_keepalive_connections=100),
+    timeout=60.0,
+)
+
+@atexit.register
+def _close_shared_http():
+    try:
+        asyncio.run(_shared_http.aclose())
+    except Exception:
+        pass # Interpreter is shutting down; nothing useful to do
+
+def _tool_call_to_api(tool_call):
+    """
+    Converts a tool call (SDK object or dict) into the plain dict the API expects.
+    Keys are always emitted in the same order (id, type, function), so the
+    serialized message is byte-identical every time it is re-sent.
+    """
+    if isinstance(tool_call, dict):
+        function = tool_call["function"]
+        return {
+            "id": tool_call["id"],
+            "type": tool_call["type"],
+            "function": {
+                "name": function["name"],
+                "arguments": function["arguments"],
+            },
+        }
+    return {
+        "id": tool_call.id,
+        "type": tool_call.type,
+        "function": {
+            "name": tool_call.function.name,
+            "arguments": tool_call.function.arguments,
+        },
+    }
+
+@dataclass(slots=True)
+class Msg:
+    """
+    One conversation message. Slots keep it much smaller than an equivalent dict,
+    which adds up over a long chat with tool calls.
+    """
+    role: str
+    content: Optional[str] = None
+    tool_calls: Optional[list] = None
+    tool_call_id: Optional[str] = None
+    name: Optional[str] = None
+
+    @classmethod
+    def from_dict(cls, msg: dict):
+        """Builds a Msg from a message dict (e.g., history loaded from JSON); extra keys are dropped."""
+        return cls(
+            role=msg["role"],
+            content=msg.get("content"),
+            tool_calls=msg.get("tool_calls"),
+            tool_call_id=msg.get("tool_call_id"),
+            name=msg.get("name"),
+        )
+
+    def to_api(self):
+        """Returns the message as the dict the chat completions API expects."""
+        role = self.role
+        content = self.content
+        # Only assistant messages (e.g., ones that just request tool calls) may have null content
+        api_msg = {"role": role, "content": content if content is not None or role == "assistant" else ""}
+        if self.tool_calls is not None:
+            api_msg["tool_calls"] = [_tool_call_to_api(tc) for tc in self.tool_calls]
+        if self.tool_call_id is not None:
+            # Messages with role 'tool' carry the id (and name) of the call they answer
+            api_msg["tool_call_id"] = self.tool_call_id
+            if self.name is not None:
+                api_msg["name"] = self.name
+        return api_msg
+
+def _filter_one(msg):
+    """Builds the API-ready form of a single message (a Msg, or a plain dict for backwards compatibility)."""
+    if type(msg) is not Msg:
+        msg = Msg.from_dict(msg)
+    return msg.to_api()
+
+def _api_message_digest(api_msg) -> bytes:
+    """
+    Returns a 16-byte digest of an API-ready message serialized the way it goes
+    over the wire (key order preserved). Comparing digests instead of keeping the
+    serialized messages keeps the per-message overhead fixed.
+    """
+    if orjson is not None:
+        dumped = orjson.dumps(api_msg)
+    else:
+        dumped = json.dumps(api_msg, separators=(",", ":"), ensure_ascii=False).encode()
+    return hashlib.blake2b(dumped, digest_size=16).digest()
+
+_prefix_log = logging.getLogger("chat_core.prefix")
+
+class ChatLog(list):
+    """
+    A conversation history list that remembers its API-ready (filtered) form.
+    History normally only grows at the end, so each turn only the newly appended
+    messages need filtering instead of the whole conversation.
+    Any other change (pop, insert, item assignment, ...) drops the cached part
+    that may no longer match. Editing a message dict in place is not detected.
+
+    The provider caches identical request prefixes, so once a message has been
+    sent it should be re-sent byte-for-byte. A digest of the serialized form of
+    every sent message is kept, and if a rewrite of the history changes an already-sent
+    message, a warning is logged ('chat_core.prefix' logger): everything from that
+    message on will miss the prefix cache.
+    Each ChatLog also has a stable `session_id`, passed as the API's `user` field
+    so that the conversation's requests land in the same cache bucket.
+    """
+
+    def __init__(self, *args):
+        super().__init__(*args)
+        self._filtered_cache = []
+        self._filtered_len = 0
+        self._sent_digests = []
+        self.session_id = f"session-{uuid.uuid4()}"
+
+    def _invalidate(self, index: int = 0, rewrite: bool = True):
+        """
+        Discards cached filtered messages from `index` onwards.
+        With `rewrite=False` (e.g., dropping the last message) the sent messages
+        from `index` on are forgotten too, since they are gone rather than changed.
+        """
+        if index < self._filtered_len:
+            del self._filtered_cache[index:]
+            self._filtered_len = index
+        if not rewrite:
+            del self._sent_digests[index:]
+
+    def api_messages(self):
+        """
+        Returns the filtered messages, filtering only what was appended since the last call.
+        The returned list is the cache itself; don't modify it.
+        """
+        if self._filtered_len > len(self):
+            self._invalidate(len(self))
+        if self._filtered_len < len(self):
+            sent_digests = self._sent_digests
+            diverged = False
+            for index in range(self._filtered_len, len(self)):
+                api_msg = _filter_one(self[index])
+                self._filtered_cache.append(api_msg)
+                digest = _api_message_digest(api_msg)
+                if index < len(sent_digests):
+                    if not diverged and sent_digests[index] != digest:
+                        _prefix_log.warning(
+                            "Message %d differs from what was sent before; the prompt cache will miss from here.", index
+                        )
+                        diverged = True
+                    sent_digests[index] = digest
+                else:
+                    sent_digests.append(digest)
+            self._filtered_len = len(self)
+        return self._filtered_cache
+
+    def pop(self, index: int = -1):
+        item = super().pop(index)
+        # A pop from the end (the common "undo last message" case) keeps the rest of the cache
+        position = index if index >= 0 else len(self) + index + 1
+        self._invalidate(position, rewrite=position < len(self))
+        return item
+
+    def insert(self, index, item):
+        super().insert(index, item)
+        self._invalidate()
+
+    def remove(self, item):
+        position = self.index(item)
+        super().__delitem__(position)
+        self._invalidate(position, rewrite=position < len(self))
+
+    def clear(self):
+        super().clear()
+        self._invalidate(rewrite=False)
+
+    def sort(self, *args, **kwargs):
+        super().sort(*args, **kwargs)
+        self._invalidate()
+
+    def reverse(self):
+        super().reverse()
+        self._invalidate()
+
+    def __setitem__(self, index, value):
+        super().__setitem__(index, value)
+        self._invalidate()
+
+    def __delitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(len(self))
+            tail = step == 1 and stop >= len(self)
+            if step != 1:
+                start = 0
+        else:
+            start = index if index >= 0 else len(self) + index
+            tail = start == len(self) - 1
+        super().__delitem__(index)
+        # Like pop(), deleting from the end leaves the remaining messages as sent
+        self._invalidate(start, rewrite=not tail)
+
+    def __imul__(self, n):
+        result = super().__imul__(n)
+        self._invalidate()
+        return result
+
+# Prompt budget for the 8k-context default model, leaving room for the reply (max_tokens=1024)
+MAX_PROMPT_TOKENS = 6000
+# Rough per-message overhead of the chat format (role, separators)
+_TOKENS_PER_MESSAGE = 4
+# Older messages are dropped in blocks of this many, so the kept part of the
+# conversation (and the provider's cached prefix for it) stays the same for
+# several turns instead of shifting by one message every turn.
+TRIM_BLOCK_MESSAGES = 8
+_trim_log = logging.getLogger("chat_core.trim")
+
+def count_tokens(text: str) -> int:
+    """Counts (or, without tiktoken, estimates) the tokens in a string."""
+    if not text:
+        return 0
+    if _enc is not None:
+        return len(_enc.encode(text))
+    return (len(text) + 3) // 4
+
+# Tokens in the system prompt, computed once for prompt budgeting
+SYSTEM_PROMPT_TOKEN_COUNT = count_tokens(CODING_ASSISTANT_SYSTEM_PROMPT)
+
+def _message_tokens(api_msg) -> int:
+    content = api_msg["content"]
+    if content == CODING_ASSISTANT_SYSTEM_PROMPT:
+        return SYSTEM_PROMPT_TOKEN_COUNT + _TOKENS_PER_MESSAGE
+    return count_tokens(content) + _TOKENS_PER_MESSAGE
+
+def trim_history(api_messages: list, max_tokens: int = MAX_PROMPT_TOKENS) -> list:
+    """
+    Bounds the prompt size with a sliding window over API-ready messages.
+    The leading system message(s) are always kept; then the most recent messages
+    are kept, newest first, until the token budget is used up, and the middle of
+    the conversation is dropped. The cut is rounded up to a multiple of
+    TRIM_BLOCK_MESSAGES after the system messages, so the window start only moves
+    every few turns. The stored history itself is not modified.
+    """
+    head = 0
+    while head < len(api_messages) and api_messages[head]["role"] == "system":
+        head += 1
+    budget = max_tokens - sum(_message_tokens(m) for m in api_messages[:head])
+
+    start = len(api_messages)
+    while start > head:
+        cost = _message_tokens(api_messages[start - 1])
+        if cost > budget:
+            break
+        budget -= cost
+        start -= 1
+    if start == head:
+        return api_messages
+    start = head + -(-(start - head) // TRIM_BLOCK_MESSAGES) * TRIM_BLOCK_MESSAGES
+    # Always send at least the newest message, even if it alone exceeds the budget
+    start = min(start, len(api_messages) - 1)
+
+    # A tool result can't be sent without the assistant message that requested it:
+    # drop leading tool results, unless they are the newest messages (the current
+    # turn), in which case reach back to include the request instead.
+    end_of_tools = start
+    while end_of_tools < len(api_messages) and api_messages[end_of_tools]["role"] == "tool":
+        end_of_tools += 1
+    if end_of_tools < len(api_messages):
+        start = end_of_tools
+    else:
+        while start > head and api_messages[start]["role"] == "tool":
+            start -= 1
+    if start == head:
+        return api_messages
+    # Logged rather than printed: callers stream the answer to stdout right after
+    _trim_log.info("Trimmed %d older message(s) to fit the %d-token prompt budget.", start - head, max_tokens)
+    return api_messages[:head] + api_messages[start:]
+
+def filter_messages_for_api(messages, _filter_one=_filter_one):
+    """
+    Filters messages to include only the keys the chat completions API accepts:
+    'role' and 'content', plus 'tool_calls', 'tool_call_id' and 'name' when present.
+    This is useful if you add custom keys to your message objects locally.
+    Messages are Msg objects; plain dicts are still accepted.
+    For a ChatLog, only messages appended since the previous call are filtered.
+    """
+    if isinstance(messages, ChatLog):
+        return messages.api_messages()
+    # _filter_one is bound as a default argument so the loop uses a fast local lookup
+    return [_filter_one(msg) for msg in messages]
+
+# Set only once a client was created, so a missing key or a failed construction
+# is retried on the next call instead of being cached.
+_groq_client = None
+_async_groq_client = None
+
+def get_groq_client():
+    """
+    Initializes and returns a Groq API client.
+    The client is created once and reused on later calls.
+    Assumes GROQ_API_KEY environment variable is set.
+    """
+    global _groq_client
+    if _groq_client is not None:
+        return _groq_client
+    try:
+        api_key = os.environ.get("GROQ_API_KEY")
+        if not api_key:
+            print(
+                "GROQ_API_KEY not found in environment variables. "
+                "Please set it."
+            )
+            return None
+        _groq_client = Groq(api_key=api_key)
+        return _groq_client
+    except Exception as e:
+        print(f"Error initializing Groq client: {e}")
+        return None
+
+def get_async_groq_client():
+    """
+    Initializes and returns an async Groq API client.
+    Use this when several requests should be in flight at once
+    (e.g., batch evaluation), since each call awaits network I/O.
+    The client is created once, reused on later calls, and shares the
+    process-wide HTTP connection pool.
+    The SDK retries rate-limited (429) and 5xx responses itself (max_retries=2),
+    waiting as long as the Retry-After header asks, so callers don't add their own
+    retry; use client.with_options(max_retries=0) where a caller does.
+    Assumes GROQ_API_KEY environment variable is set.
+    """
+    global _async_groq_client
+    if _async_groq_client is not None:
+        return _async_groq_client
+    try:
+        api_key = os.environ.get("GROQ_API_KEY")
+        if not api_key:
+            print(
+                "GROQ_API_KEY not found in environment variables. "
+                "Please set it."
+            )
+            return None
+        _async_groq_client = AsyncGroq(api_key=api_key, http_client=_shared_http)
+        return _async_groq_client
+    except Exception as e:
+        print(f"Error initializing async Groq client: {e}")
+        return None
+
+def _retry_after_seconds(error: APIStatusError, default: float) -> float:
+    """Reads the Retry-After header (in seconds) from an API error, if present."""
+    try:
+        return float(error.response.headers.get("retry-after", default))
+    except (TypeError, ValueError):
+        return default
+
+async def run_with_concurrency(calls, qpm: int = GROQ_QPM, concurrency: int = GROQ_MAX_CONCURRENCY, max_retries: int = 5):
+    """
+    Runs many API calls concurrently while staying under the rate limit.
+    `calls` are zero-argument callables returning an awaitable (e.g., a lambda
+    wrapping an async function), so that a call can be retried after a failure.
+    - At most `concurrency` calls are in flight at once.
+    - Calls are started at no more than `qpm` per minute (leaky bucket).
+    - RateLimitError: wait for the Retry-After header, then retry.
+    - 5xx errors: retry with exponential backoff (1s, 2s, 4s, ... up to 32s) plus jitter.
+    Returns the results in the same order as `calls`. A call that still fails after
+    `max_retries` retries (or fails with another error) has its exception in place of a result.
+    The calls should use a client with the SDK's retries disabled
+    (client.with_options(max_retries=0)); otherwise each attempt here can hide
+    several SDK retries that bypass the bucket.
+    """
+    calls = list(calls)
+    if not calls:
+        return []
+
+    semaphore = asyncio.Semaphore(concurrency)
+    # Each API call takes one token; the refill task adds qpm/60 tokens per second.
+    # The bucket starts empty, so calls start evenly spaced from the first one;
+    # tokens only build up (to at most `concurrency`) while no call is waiting for
+    # one, e.g. all slots are busy or calls are backing off, allowing a short burst
+    # afterwards.
+    bucket = asyncio.Queue(maxsize=max(1, concurrency))
+
+    async def refill():
+        while True:
+            await bucket.put(None)
+            await asyncio.sleep(60.0 / qpm)
+
+    async def run_one(index, call):
+        attempt = 0
+        while True:
+            async with semaphore:
+                await bucket.get()
+                try:
+                    return index, await call()
+                except RateLimitError as e:
+                    error = e
+                    delay = _retry_after_seconds(e, 1.0)
+                    print(f"Rate limited; retrying in {delay:.1f}s")
+                except APIStatusError as e:
+                    if e.status_code < 500:
+                        return index, e
+                    error = e
+                    delay = min(1.0 * 2 ** attempt, 32.0) + random.uniform(0, 1.0)
+                    print(f"Groq API Error {e.status_code}; retrying in {delay:.1f}s")
+                except Exception as e:
+                    return index, e
+            if attempt >= max_retries:
+                return index, error
+            attempt += 1
+            # Sleep outside the semaphore so other calls can use the slot meanwhile
+            await asyncio.sleep(delay)
+
+    refill_task = asyncio.create_task(refill())
+    try:
+        results = [None] * len(calls)
+        for next_done in asyncio.as_completed([run_one(i, call) for i, call in enumerate(calls)]):
+            index, result = await next_done
+            results[index] = result
+        return results
+    finally:
+        refill_task.cancel()
+
+if __name__ == "__main__":
+    # Example usage:
+    client = get_groq_client()
+    if client:
+        print("Successfully initialized Groq client!")
+    else:
+        print("Failed to initialize Groq client.")
+
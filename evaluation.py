@@ -1,10 +1,41 @@
-import os
 import json
-from groq import Groq, APIError
+import asyncio
+from groq import AsyncGroq, APIError, BadRequestError, RateLimitError
+from chat_core import *
+from response_cache import get_response_cache
 
-# (Re-include get_groq_client if running standalone)
-DEFAULT_MODEL = "llama3-8b-8192" # Model for the main assistant
-EVALUATION_MODEL = "llama3-8b-8192" # Can be the same or different
+# orjson is much faster than the stdlib json module for parsing many evaluations,
+# but it's optional: fall back to json if it isn't installed.
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+EVALUATION_MODEL = "llama-3.3-70b-versatile" # Supports JSON mode (response_format)
+# JSON mode guarantees a JSON object, so the evaluation can be parsed directly
+EVALUATION_RESPONSE_FORMAT = {"type": "json_object"}
+# Models with Structured Outputs go further: decoding is constrained to this
+# schema, so the fields and their types are guaranteed too.
+JSON_SCHEMA_MODELS = {
+    "openai/gpt-oss-20b",
+    "openai/gpt-oss-120b",
+    "moonshotai/kimi-k2-instruct",
+    "meta-llama/llama-4-maverick-17b-128e-instruct",
+    "meta-llama/llama-4-scout-17b-16e-instruct",
+}
+EVALUATION_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "is_coding_related": {"type": "boolean"},
+        "helpfulness_rating": {"type": ["integer", "null"], "minimum": 1, "maximum": 5},
+        "refusal_appropriateness": {"type": ["boolean", "null"]},
+        "reasoning": {"type": "string"},
+    },
+    "required": ["is_coding_related", "helpfulness_rating", "refusal_appropriateness", "reasoning"],
+    "additionalProperties": False,
+}
+EVALUATION_TEMPERATURE = 0.2 # Low temperature for more deterministic JSON
+EVALUATION_MAX_TOKENS = 500
 
 EVALUATION_SYSTEM_PROMPT = """
 You are an Evaluation AI. Your task is to evaluate the Coding Assistant's response to a user's query.
@@ -31,15 +62,33 @@ Output your evaluation in JSON format like this:
 }
 """
 
-def evaluate_response(client: Groq, user_query: str, assistant_response: str, model: str = EVALUATION_MODEL):
+def _json_loads(data: str):
+    """Parses a JSON string, using orjson when available."""
+    if orjson is not None:
+        # orjson.JSONDecodeError subclasses json.JSONDecodeError
+        return orjson.loads(data.encode())
+    return json.loads(data)
+
+def _json_dumps(obj, indent: bool = False) -> str:
+    """Serializes an object to a JSON string, using orjson when available."""
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2 if indent else None).decode()
+    return json.dumps(obj, indent=2 if indent else None)
+
+def _evaluation_response_format(model: str):
     """
-    Uses an LLM to evaluate the assistant's response to a user query.
+    Returns the response_format for an evaluation request: the JSON schema for
+    models that support it, plain JSON mode otherwise.
     """
-    if not client:
-        print("Groq client is not initialized for evaluation.")
-        return None
+    if model in JSON_SCHEMA_MODELS:
+        return {"type": "json_schema", "json_schema": {"name": "evaluation", "schema": EVALUATION_SCHEMA}}
+    return EVALUATION_RESPONSE_FORMAT
 
-    evaluation_prompt_messages = [
+def _build_evaluation_messages(user_query: str, assistant_response: str):
+    """
+    Builds the messages sent to the evaluation model for one (query, response) pair.
+    """
+    return [
         {"role": "system", "content": EVALUATION_SYSTEM_PROMPT},
         {
             "role": "user",
@@ -47,87 +96,256 @@ def evaluate_response(client: Groq, user_query: str, assistant_response: str, mo
         },
     ]
 
+def _parse_evaluation(evaluation_content: str):
+    """
+    Parses the JSON evaluation returned by the model in JSON mode.
+    Returns None if it isn't valid JSON.
+    """
     try:
-        # Ensure the model is instructed to output JSON
-        # Some models support a response_format parameter.
-        # For Groq with Llama3, explicitly asking in the prompt is key.
-        chat_completion = client.chat.completions.create(
-            messages=evaluation_prompt_messages,
-            model=model,
-            temperature=0.2, # Low temperature for more deterministic JSON
-            max_tokens=500,
-            # response_format={"type": "json_object"}, # If supported by model/Groq for this model
-        )
-        evaluation_content = chat_completion.choices[0].message.content
-
-        # Attempt to parse the JSON from the response
-        # LLMs might sometimes include explanations around the JSON block.
-        try:
-            # Find the start and end of the JSON block
-            json_start = evaluation_content.find('{')
-            json_end = evaluation_content.rfind('}') + 1
-            if json_start != -1 and json_end != 0 and json_end > json_start:
-                json_string = evaluation_content[json_start:json_end]
-                parsed_evaluation = json.loads(json_string)
-                return parsed_evaluation
-            else:
-                print("Could not find JSON block in evaluation response.")
-                print(f"Raw evaluation response: {evaluation_content}")
-                return {"error": "Failed to parse JSON, block not found", "raw_response": evaluation_content}
-
-        except json.JSONDecodeError as e:
-            print(f"JSONDecodeError in evaluation: {e}")
-            print(f"Raw evaluation response: {evaluation_content}")
+        return _json_loads(evaluation_content)
+    except json.JSONDecodeError as e:
+        print(f"JSONDecodeError in evaluation: {e}")
+        print(f"Raw evaluation response: {evaluation_content}")
+        return None
+
+def _failed_json_generation(error: BadRequestError):
+    """
+    In JSON mode Groq rejects output that isn't valid JSON (e.g., cut off at
+    max_tokens) with a 400 'json_validate_failed' error instead of returning it.
+    For that error, returns the rejected output (or "" if absent); otherwise None.
+    """
+    body = error.body if isinstance(error.body, dict) else {}
+    if getattr(error, "code", None) != "json_validate_failed" and body.get("code") != "json_validate_failed":
+        return None
+    return body.get("failed_generation") or ""
+
+async def evaluate_response(client: AsyncGroq, user_query: str, assistant_response: str, model: str = EVALUATION_MODEL,
+                            use_cache: bool = True, raise_api_errors: bool = False):
+    """
+    Uses an LLM to evaluate the assistant's response to a user query.
+    With `use_cache`, re-evaluating the exact same (query, response) pair reuses the cached evaluation.
+    With `raise_api_errors`, Groq API errors are raised instead of printed, so a caller
+    such as run_with_concurrency can retry them.
+    """
+    if not client:
+        print("Groq client is not initialized for evaluation.")
+        return None
+
+    # Only exact matches are reused: a slightly different response may deserve a different score.
+    cache_query = f"{user_query}\n\n{assistant_response}"
+    if use_cache:
+        cached_evaluation, _ = await get_response_cache().aget(model, EVALUATION_SYSTEM_PROMPT, cache_query, semantic=False)
+        if cached_evaluation is not None:
+            return _json_loads(cached_evaluation)
+
+    evaluation_prompt_messages = _build_evaluation_messages(user_query, assistant_response)
+
+    try:
+        # If the output still fails to parse or is rejected as invalid JSON (e.g.,
+        # cut off at max_tokens), retry once deterministically with a little more room.
+        attempts = [
+            (EVALUATION_TEMPERATURE, EVALUATION_MAX_TOKENS),
+            (0.0, EVALUATION_MAX_TOKENS + 128),
+        ]
+        for temperature, max_tokens in attempts:
+            try:
+                chat_completion = await client.chat.completions.create(
+                    messages=evaluation_prompt_messages,
+                    model=model,
+                    temperature=temperature,
+                    max_tokens=max_tokens,
+                    response_format=_evaluation_response_format(model),
+                )
+            except BadRequestError as e:
+                evaluation_content = _failed_json_generation(e)
+                if evaluation_content is None:
+                    raise
+                print(f"Evaluation output failed JSON validation: {e}")
+                continue
+            evaluation_content = chat_completion.choices[0].message.content
+            parsed_evaluation = _parse_evaluation(evaluation_content)
+            if parsed_evaluation is not None:
+                break
+        else:
             return {"error": "Failed to parse JSON", "raw_response": evaluation_content}
 
-    except APIError as e:
-        print(f"Groq API Error during evaluation: {e}")
+        if use_cache:
+            await get_response_cache().aset(model, EVALUATION_SYSTEM_PROMPT, cache_query, _json_dumps(parsed_evaluation), semantic=False)
+        return parsed_evaluation
+
     except RateLimitError as e:
+        if raise_api_errors:
+            raise
         print(f"Groq Rate Limit Error during evaluation: {e}")
+    except APIError as e:
+        if raise_api_errors:
+            raise
+        print(f"Groq API Error during evaluation: {e}")
     except Exception as e:
         print(f"An unexpected error occurred during evaluation: {e}")
     return None
 
+async def evaluate_responses(client: AsyncGroq, pairs: list, model: str = EVALUATION_MODEL, qpm: int = GROQ_QPM):
+    """
+    Evaluates many (user_query, assistant_response) pairs concurrently,
+    throttled to `qpm` requests per minute and retrying rate-limited requests.
+    Returns the evaluations in the same order as `pairs`.
+    """
+    if not client:
+        print("Groq client is not initialized for evaluation.")
+        return [None] * len(pairs)
+
+    # run_with_concurrency does all the retrying, paced by its bucket; the SDK's
+    # own retries would stack on top of it, so they are turned off here.
+    driven_client = client.with_options(max_retries=0)
+    results = await run_with_concurrency(
+        [
+            lambda user_query=user_query, assistant_response=assistant_response: evaluate_response(
+                driven_client, user_query, assistant_response, model, raise_api_errors=True
+            )
+            for user_query, assistant_response in pairs
+        ],
+        qpm=qpm,
+    )
+    evaluations = []
+    for result in results:
+        if isinstance(result, Exception):
+            print(f"Evaluation failed: {result}")
+            result = None
+        evaluations.append(result)
+    return evaluations
+
+async def evaluate_responses_batch(client: AsyncGroq, pairs: list, model: str = EVALUATION_MODEL,
+                                   timeout: float = 600.0, poll_interval: float = 10.0):
+    """
+    Evaluates many (user_query, assistant_response) pairs through the Groq Batch API.
+    Batch jobs are cheaper than one request per pair but may take a while to run,
+    so if the batch has not finished within `timeout` seconds it is cancelled and
+    the pairs are evaluated with `evaluate_responses` instead.
+    Returns the evaluations in the same order as `pairs`.
+    """
+    if not pairs:
+        return []
+    if not client:
+        print("Groq client is not initialized for evaluation.")
+        return [None] * len(pairs)
+
+    evaluations = [None] * len(pairs)
+    pending = set(range(len(pairs)))
+    batch = None
+    timed_out = False
+
+    try:
+        # One JSONL line per pair; custom_id maps results back to their index.
+        lines = []
+        for i, (user_query, assistant_response) in enumerate(pairs):
+            lines.append(_json_dumps({
+                "custom_id": str(i),
+                "method": "POST",
+                "url": "/v1/chat/completions",
+                "body": {
+                    "model": model,
+                    "messages": _build_evaluation_messages(user_query, assistant_response),
+                    "temperature": EVALUATION_TEMPERATURE,
+                    "max_tokens": EVALUATION_MAX_TOKENS,
+                    "response_format": _evaluation_response_format(model),
+                },
+            }))
+        batch_input = ("\n".join(lines) + "\n").encode("utf-8")
+
+        input_file = await client.files.create(file=("evaluation_batch.jsonl", batch_input), purpose="batch")
+        batch = await client.batches.create(
+            input_file_id=input_file.id,
+            endpoint="/v1/chat/completions",
+            completion_window="24h",
+        )
+        print(f"Submitted evaluation batch {batch.id} with {len(pairs)} requests.")
+
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while batch.status not in ("completed", "failed", "expired", "cancelled"):
+            if loop.time() >= deadline:
+                print(f"Evaluation batch {batch.id} did not finish within {timeout}s; cancelling.")
+                await client.batches.cancel(batch.id)
+                timed_out = True # `batch` still holds the last polled status
+                break
+            await asyncio.sleep(poll_interval)
+            batch = await client.batches.retrieve(batch.id)
+
+        if batch.status == "completed" and batch.output_file_id:
+            output = await client.files.content(batch.output_file_id)
+            for line in (await output.text()).splitlines():
+                if not line.strip():
+                    continue
+                result = _json_loads(line)
+                response = result.get("response") or {}
+                if result.get("error") or response.get("status_code") != 200:
+                    print(f"Batch request {result.get('custom_id')} failed: {result.get('error')}")
+                    continue
+                i = int(result["custom_id"])
+                evaluation_content = response["body"]["choices"][0]["message"]["content"]
+                parsed_evaluation = _parse_evaluation(evaluation_content)
+                if parsed_evaluation is not None:
+                    # Unparseable results are left pending for the fallback, which retries them
+                    evaluations[i] = parsed_evaluation
+                    pending.discard(i)
+        elif batch.status != "completed" and not timed_out:
+            print(f"Evaluation batch {batch.id} ended with status '{batch.status}'.")
+
+    except RateLimitError as e:
+        print(f"Groq Rate Limit Error during batch evaluation: {e}")
+    except APIError as e:
+        print(f"Groq API Error during batch evaluation: {e}")
+    except Exception as e:
+        print(f"An unexpected error occurred during batch evaluation: {e}")
+
+    # Fall back to per-pair requests for anything the batch did not produce.
+    if pending:
+        print(f"Falling back to direct evaluation for {len(pending)} pair(s).")
+        indices = sorted(pending)
+        results = await evaluate_responses(client, [pairs[i] for i in indices], model)
+        for i, evaluation in zip(indices, results):
+            evaluations[i] = evaluation
+
+    return evaluations
+
 if __name__ == "__main__":
     # Example usage:
-    # from your_module_1 import get_groq_client
-    # client = get_groq_client()
+    # Ensure GROQ_API_KEY is set in your environment.
+    # The shared client reuses one HTTP connection pool for all requests.
+    client = get_async_groq_client()
 
-    # For standalone testing:
-    def get_groq_client_local():
-        api_key = os.environ.get("GROQ_API_KEY")
-        if not api_key: return None
-        return Groq(api_key=api_key)
-    client = get_groq_client_local()
+    async def main():
+        scenarios = [
+            # Scenario 1: Coding question, good answer
+            (
+                "What is a decorator in Python?",
+                "A decorator in Python is a design pattern that allows you to modify or enhance functions or methods in a clean and readable way. It's a callable that takes another function as an argument (the decorated function) and returns a new function or modifies the original one.",
+            ),
+            # Scenario 2: Off-topic question, good refusal
+            (
+                "What's the weather like today?",
+                "My apologies, but I'm programmed to assist with coding-related queries only.",
+            ),
+            # Scenario 3: Coding question, poor/irrelevant answer
+            (
+                "How do I sort a list in Python?",
+                "Paris is the capital of France.", # Clearly wrong for the query
+            ),
+        ]
 
-    if client:
-        # Scenario 1: Coding question, good answer
-        query1 = "What is a decorator in Python?"
-        response1 = "A decorator in Python is a design pattern that allows you to modify or enhance functions or methods in a clean and readable way. It's a callable that takes another function as an argument (the decorated function) and returns a new function or modifies the original one."
-        evaluation1 = evaluate_response(client, query1, response1)
-        print(f"\n--- Evaluation for Query 1 ---")
-        print(f"User Query: {query1}")
-        print(f"Assistant Response: {response1}")
-        print(f"Evaluation: {json.dumps(evaluation1, indent=2)}")
-
-        # Scenario 2: Off-topic question, good refusal
-        query2 = "What's the weather like today?"
-        response2 = "My apologies, but I'm programmed to assist with coding-related queries only."
-        evaluation2 = evaluate_response(client, query2, response2)
-        print(f"\n--- Evaluation for Query 2 ---")
-        print(f"User Query: {query2}")
-        print(f"Assistant Response: {response2}")
-        print(f"Evaluation: {json.dumps(evaluation2, indent=2)}")
-
-        # Scenario 3: Coding question, poor/irrelevant answer
-        query3 = "How do I sort a list in Python?"
-        response3 = "Paris is the capital of France." # Clearly wrong for the query
-        evaluation3 = evaluate_response(client, query3, response3)
-        print(f"\n--- Evaluation for Query 3 ---")
-        print(f"User Query: {query3}")
-        print(f"Assistant Response: {response3}")
-        print(f"Evaluation: {json.dumps(evaluation3, indent=2)}")
+        # The evaluations are independent, so run them concurrently
+        # (throttled to the rate limit) instead of waiting on each network round-trip in turn.
+        evaluations = await evaluate_responses(client, scenarios)
+
+        for i, ((query, response), evaluation) in enumerate(zip(scenarios, evaluations), start=1):
+            print(f"\n--- Evaluation for Query {i} ---")
+            print(f"User Query: {query}")
+            print(f"Assistant Response: {response}")
+            print(f"Evaluation: {_json_dumps(evaluation, indent=True)}")
 
+    if client:
+        asyncio.run(main())
     else:
         print("Failed to initialize Groq client. Cannot run evaluation example.")
 
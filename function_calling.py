@@ -1,15 +1,30 @@
-import os
+import re
 import json
-from datetime import datetime
-from groq import Groq, APIError
-
-# (Re-include get_groq_client, CODING_ASSISTANT_SYSTEM_PROMPT, filter_messages_for_api if running standalone)
-DEFAULT_MODEL = "llama3-8b-8192"
+import time
+import uuid
+import asyncio
+import inspect
+from groq import AsyncGroq, APIError, RateLimitError, NOT_GIVEN
+from chat_core import *
 
 # 1. Define the function our AI can call
+# (second, formatted string) of the last call, stored as one tuple so that
+# concurrent callers (tools run in worker threads) never see a mismatched pair
+_last_datetime = (None, "")
+
 def get_current_datetime():
-    """Returns the current date and time as a string."""
-    return datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    """Returns the current local date and time as a 'YYYY-MM-DD HH:MM:SS' string."""
+    global _last_datetime
+    t = int(time.time())
+    last_second, last_string = _last_datetime
+    # The string only changes once per second, so reuse it within the same second
+    if t == last_second:
+        return last_string
+    lt = time.localtime(t)
+    # Formatting the fields directly avoids strftime's directive parsing
+    formatted = f"{lt.tm_year:04d}-{lt.tm_mon:02d}-{lt.tm_mday:02d} {lt.tm_hour:02d}:{lt.tm_min:02d}:{lt.tm_sec:02d}"
+    _last_datetime = (t, formatted)
+    return formatted
 
 # 2. Define the schema for the tools the LLM can use
 TOOLS_SCHEMA = [
@@ -27,188 +42,219 @@ TOOLS_SCHEMA = [
     }
 ]
 
+# Every chat call in run_conversation_with_tools sends this schema, including
+# the final tool_choice="none" call, so all of them share the same tools part of
+# the prompt. It is passed to the SDK by reference and must never be copied or
+# modified per request, or that part would stop being identical between turns.
+
+# Tool-use guidance is sent as its own message after the shared system prompt,
+# so the system prompt (and the provider's cached prefix for it) stays unchanged.
+TOOL_USE_INSTRUCTIONS = (
+    "**Function Calling:** You have access to a tool called 'get_current_datetime'. "
+    "Use it if the user's query implies needing the current time to answer a coding-related question "
+    "(e.g., \"Are there any Python conferences happening next week based on today's date?\")."
+)
+
 # Available functions mapping
 AVAILABLE_FUNCTIONS = {
     "get_current_datetime": get_current_datetime,
 }
 
-def run_conversation_with_tools(client: Groq, conversation_history: list, new_user_query: str, model: str = DEFAULT_MODEL):
+# Local intent router: queries that obviously need a tool skip the
+# tool-selection API call; the tool runs right away and the model is only
+# asked once, to write the answer. Each entry is (pattern, tool name, arguments).
+# A pattern must match the whole query (trailing punctuation aside): questions
+# that merely mention dates or times ("What is the time complexity of
+# quicksort?", "How do I parse date and time strings?") go to the model.
+TOOL_ROUTES = [
+    (
+        re.compile(
+            r"what(?:'s| is) the (?:current )?(?:date and time|date|time)(?: (?:now|today|right now))?"
+            r"|what(?:'s| is) today'?s date"
+            r"|what time is it(?: (?:now|right now))?"
+            r"|(?:can you )?tell me the (?:current )?(?:date and time|date|time)(?: (?:now|right now))?",
+            re.IGNORECASE,
+        ),
+        "get_current_datetime",
+        {},
+    ),
+]
+
+def _detect_tool(query: str):
+    """
+    Returns (tool name, arguments) if the query clearly calls for a tool, otherwise None.
+    """
+    query = query.strip().rstrip("?!. ")
+    for pattern, function_name, function_args in TOOL_ROUTES:
+        if pattern.fullmatch(query):
+            return function_name, function_args
+    return None
+
+async def _run_tool(tool_call_id: str, function_name: str):
+    """
+    Executes a requested tool and returns the 'tool' message holding its result.
+    Async tools are awaited; plain functions run in a worker thread so a slow
+    (e.g., I/O-bound) tool doesn't block the event loop.
+    """
+    if function_name in AVAILABLE_FUNCTIONS:
+        # 4. Execute the function
+        function_to_call = AVAILABLE_FUNCTIONS[function_name]
+        print(f"Executing function: {function_name}")
+        try:
+            # For simplicity, assuming no arguments for get_current_datetime
+            if inspect.iscoroutinefunction(function_to_call):
+                function_response = await function_to_call()
+            else:
+                function_response = await asyncio.to_thread(function_to_call)
+            print(f"Function response: {function_response}")
+        except Exception as e:
+            print(f"Error executing function {function_name}: {e}")
+            function_response = f"Error: {e}"
+    else:
+        print(f"Unknown function requested: {function_name}")
+        function_response = f"Error: Unknown function '{function_name}'"
+
+    # 5. Send the function's output back to the LLM
+    return Msg(
+        role="tool",
+        tool_call_id=tool_call_id,
+        name=function_name,
+        content=function_response,
+    )
+
+async def run_conversation_with_tools(client: AsyncGroq, conversation_history: list[Msg], new_user_query: str, model: str = DEFAULT_MODEL):
     """
     Handles a conversation turn, including potential function calls.
+    If the local router recognizes the query as needing a tool, the tool is run
+    directly and only one API call (for the final answer) is made.
     """
     if not client:
         print("Groq client not initialized.")
         return None, conversation_history
 
-    conversation_history.append({"role": "user", "content": new_user_query})
-    
-    # Ensure system prompt is the first message
-    # (Assuming it's already there from initialization)
-    api_ready_messages = filter_messages_for_api(conversation_history)
+    conversation_history.append(Msg(role="user", content=new_user_query))
 
     try:
-        # First API call: Allow the LLM to decide if it needs to use a tool
-        print("--- Sending to LLM (tool_choice='auto') ---")
-        # print(f"Messages sent: {json.dumps(api_ready_messages, indent=2)}")
+        routed_tool = _detect_tool(new_user_query)
+        if routed_tool:
+            function_name, function_args = routed_tool
+            print(f"--- Local router selected tool '{function_name}' (skipping tool-selection call) ---")
+            # Record the call as if the model had requested it, so the tool message has a matching tool_call
+            tool_call_id = f"call_{uuid.uuid4().hex[:24]}"
+            conversation_history.append(
+                Msg(
+                    role="assistant",
+                    content=None,
+                    tool_calls=[
+                        {
+                            "id": tool_call_id,
+                            "type": "function",
+                            "function": {"name": function_name, "arguments": json.dumps(function_args)},
+                        }
+                    ],
+                )
+            )
+            conversation_history.append(await _run_tool(tool_call_id, function_name))
+        else:
+            # Ensure system prompt is the first message
+            # (Assuming it's already there from initialization)
+            api_ready_messages = trim_history(filter_messages_for_api(conversation_history))
 
-        chat_completion = client.chat.completions.create(
-            messages=api_ready_messages,
-            model=model,
-            tools=TOOLS_SCHEMA,
-            tool_choice="auto", # "auto" lets the model decide, "none" forces no tools
-            temperature=0.7,
-            max_tokens=1024,
-        )
-        response_message = chat_completion.choices[0].message
-        # print(f"LLM raw response: {response_message}")
+            # First API call: Allow the LLM to decide if it needs to use a tool
+            print("--- Sending to LLM (tool_choice='auto') ---")
+            # print(f"Messages sent: {json.dumps(api_ready_messages, indent=2)}")
 
+            chat_completion = await client.chat.completions.create(
+                messages=api_ready_messages,
+                model=model,
+                user=getattr(conversation_history, "session_id", NOT_GIVEN), # Stable per-conversation id for prefix caching
+                tools=TOOLS_SCHEMA,
+                tool_choice="auto", # "auto" lets the model decide, "none" forces no tools
+                temperature=0.7,
+                max_tokens=1024,
+            )
+            response_message = chat_completion.choices[0].message
+            # print(f"LLM raw response: {response_message}")
+
+            # 3. Check if the LLM wants to call a tool
+            if not response_message.tool_calls:
+                # No tool call, just a direct answer
+                print("--- LLM provided a direct answer ---")
+                assistant_response_content = response_message.content
+                conversation_history.append(Msg(role="assistant", content=assistant_response_content))
+                return assistant_response_content, conversation_history
 
-        # 3. Check if the LLM wants to call a tool
-        if response_message.tool_calls:
             print("--- LLM requested a tool call ---")
             # Append the assistant's intent to call a function (contains tool_calls)
             conversation_history.append(
-                {
-                    "role": "assistant",
-                    "content": response_message.content, # May be None
-                    "tool_calls": response_message.tool_calls,
-                }
+                Msg(
+                    role="assistant",
+                    content=response_message.content, # May be None
+                    tool_calls=response_message.tool_calls,
+                )
             )
-
-            for tool_call in response_message.tool_calls:
-                function_name = tool_call.function.name
-                # function_args = json.loads(tool_call.function.arguments) # If args were expected
-
-                if function_name in AVAILABLE_FUNCTIONS:
-                    # 4. Execute the function
-                    function_to_call = AVAILABLE_FUNCTIONS[function_name]
-                    print(f"Executing function: {function_name}")
-                    try:
-                        # For simplicity, assuming no arguments for get_current_datetime
-                        function_response = function_to_call()
-                        print(f"Function response: {function_response}")
-
-                        # 5. Send the function's output back to the LLM
-                        conversation_history.append(
-                            {
-                                "role": "tool",
-                                "tool_call_id": tool_call.id,
-                                "name": function_name,
-                                "content": function_response,
-                            }
-                        )
-                    except Exception as e:
-                        print(f"Error executing function {function_name}: {e}")
-                        conversation_history.append(
-                            {
-                                "role": "tool",
-                                "tool_call_id": tool_call.id,
-                                "name": function_name,
-                                "content": f"Error: {e}",
-                            }
-                        )
-                else:
-                    print(f"Unknown function requested: {function_name}")
-                    conversation_history.append(
-                        {
-                            "role": "tool",
-                            "tool_call_id": tool_call.id,
-                            "name": function_name,
-                            "content": f"Error: Unknown function '{function_name}'",
-                        }
-                    )
-            
-            # Second API call: LLM processes the tool's response
-            print("--- Sending tool response to LLM (tool_choice='none') ---")
-            api_ready_messages_after_tool = filter_messages_for_api(conversation_history)
-            # print(f"Messages sent: {json.dumps(api_ready_messages_after_tool, indent=2)}")
-
-            final_completion = client.chat.completions.create(
-                messages=api_ready_messages_after_tool,
-                model=model,
-                tool_choice="none", # Important: prevent recursion
-                temperature=0.7,
-                max_tokens=1024,
+            # The requested calls are independent, so run them concurrently;
+            # gather keeps the results in the order the calls were requested.
+            # function_args = json.loads(tool_call.function.arguments) # If args were expected
+            tool_results = await asyncio.gather(
+                *[_run_tool(tool_call.id, tool_call.function.name) for tool_call in response_message.tool_calls],
+                return_exceptions=True,
             )
-            final_response_content = final_completion.choices[0].message.content
-            conversation_history.append({"role": "assistant", "content": final_response_content})
-            return final_response_content, conversation_history
-        else:
-            # No tool call, just a direct answer
-            print("--- LLM provided a direct answer ---")
-            assistant_response_content = response_message.content
-            conversation_history.append({"role": "assistant", "content": assistant_response_content})
-            return assistant_response_content, conversation_history
+            for tool_call, tool_message in zip(response_message.tool_calls, tool_results):
+                if isinstance(tool_message, Exception):
+                    # Every tool_call needs a matching tool message, even if running it failed
+                    tool_message = Msg(
+                        role="tool",
+                        tool_call_id=tool_call.id,
+                        name=tool_call.function.name,
+                        content=f"Error: {tool_message}",
+                    )
+                conversation_history.append(tool_message)
+
+        # Final API call: LLM processes the tool's response
+        print("--- Sending tool response to LLM (tool_choice='none') ---")
+        api_ready_messages_after_tool = trim_history(filter_messages_for_api(conversation_history))
+        # print(f"Messages sent: {json.dumps(api_ready_messages_after_tool, indent=2)}")
+
+        final_completion = await client.chat.completions.create(
+            messages=api_ready_messages_after_tool,
+            model=model,
+            user=getattr(conversation_history, "session_id", NOT_GIVEN), # Stable per-conversation id for prefix caching
+            tools=TOOLS_SCHEMA, # Same tools as the tool-selection call, so both render the same prompt prefix
+            tool_choice="none", # Important: prevent recursion
+            temperature=0.7,
+            max_tokens=1024,
+        )
+        final_response_content = final_completion.choices[0].message.content
+        conversation_history.append(Msg(role="assistant", content=final_response_content))
+        return final_response_content, conversation_history
 
-    except APIError as e:
-        print(f"Groq API Error: {e}")
     except RateLimitError as e:
         print(f"Groq Rate Limit Error: {e}")
+    except APIError as e:
+        print(f"Groq API Error: {e}")
     except Exception as e:
         print(f"An unexpected error occurred: {e}")
     return None, conversation_history
 
-
 if __name__ == "__main__":
     # Example usage:
-    # from your_module_1 import get_groq_client
-    # client = get_groq_client()
-
-    # For standalone testing:
-    def get_groq_client_local():
-        api_key = os.environ.get("GROQ_API_KEY")
-        if not api_key: return None
-        return Groq(api_key=api_key)
-    client = get_groq_client_local()
-
-    CODING_ASSISTANT_SYSTEM_PROMPT = """
-    You are a specialized Coding Assistant AI. Your primary goal is to assist users with their coding-related questions.
-    You must strictly adhere to the following guidelines:
-    1.  **Scope of Assistance:** Only answer questions directly related to programming, software development, algorithms, data structures, coding tools (IDEs, compilers, debuggers, version control), APIs, SDKs, and software architecture.
-    2.  **Refusal for Off-Topic Questions:** If a user asks a question outside this scope (e.g., about history, biology, general knowledge, opinions, personal advice), you MUST politely refuse to answer. You can say something like: "I am a specialized coding assistant and cannot answer questions outside of programming topics." or "My apologies, but I'm programmed to assist with coding-related queries only." Do NOT attempt to answer off-topic questions.
-    3.  **Function Calling:** You have access to a tool called 'get_current_datetime'. Use it if the user's query implies needing the current time to answer a coding-related question (e.g., "Are there any Python conferences happening next week based on today's date?").
-    """ # Updated for tool use
-
-    # (Include filter_messages_for_api if not imported)
-    def filter_messages_for_api(messages):
-        api_messages = []
-        for msg in messages:
-            api_msg = {"role": msg["role"]}
-            if "content" in msg and msg["content"] is not None:
-                api_msg["content"] = msg["content"]
-            if "tool_calls" in msg and msg["tool_calls"] is not None:
-                api_msg["tool_calls"] = [
-                    {
-                        "id": tc.id,
-                        "type": tc.type,
-                        "function": {
-                            "name": tc.function.name,
-                            "arguments": tc.function.arguments,
-                        },
-                    }
-                    for tc in msg["tool_calls"]
-                ]
-            if msg["role"] == "tool": # tool messages have name and tool_call_id
-                api_msg["tool_call_id"] = msg["tool_call_id"]
-                api_msg["name"] = msg["name"]
-            # Ensure content is not None for roles that require it, unless it's an assistant expecting a tool_call
-            if msg["role"] != "assistant" and api_msg.get("content") is None and "tool_calls" not in api_msg and msg["role"] != "tool":
-                api_msg["content"] = "" 
-            elif msg["role"] == "assistant" and "tool_calls" in msg and msg.get("content") is None:
-                 api_msg["content"] = None # Groq allows this for assistant message with tool_calls
-            api_messages.append(api_msg)
-        return api_messages
-
+    # Ensure GROQ_API_KEY is set in your environment.
+    # The shared client reuses one HTTP connection pool for all requests.
+    client = get_async_groq_client()
 
     if client:
-        chat_log = [{"role": "system", "content": CODING_ASSISTANT_SYSTEM_PROMPT}]
+        chat_log = ChatLog([
+            Msg(role="system", content=CODING_ASSISTANT_SYSTEM_PROMPT),
+            Msg(role="system", content=TOOL_USE_INSTRUCTIONS),
+        ])
         
         # query = "What time is it right now?"
         query = "Can you tell me the current date and time to help me timestamp a log file in Python?"
         # query = "What is a Python dictionary?" # Test non-tool use
 
         print(f"User: {query}")
-        response, chat_log = run_conversation_with_tools(client, chat_log, query)
+        response, chat_log = asyncio.run(run_conversation_with_tools(client, chat_log, query))
 
         if response:
             print(f"Assistant: {response}")
@@ -1,29 +1,39 @@
-import os
-from groq import Groq, APIError
+import asyncio
+from groq import AsyncGroq, APIError, RateLimitError
+from chat_core import *
+from response_cache import get_response_cache
 
-# (Re-include get_groq_client from Module 1 if running standalone)
-# def get_groq_client(): ...
+class _StreamFailed(str):
+    """Empty-string chunk that marks a stream which ended on an error."""
 
-DEFAULT_MODEL = "llama3-8b-8192" # Or any other model you prefer
+# Yielded last by ask_llm_basic when the request fails, so consumers can tell a
+# truncated answer from a complete one. It prints as an empty string.
+STREAM_FAILED = _StreamFailed()
 
-# System prompt defining the AI's role and behavior
-CODING_ASSISTANT_SYSTEM_PROMPT = """
-You are a specialized Coding Assistant AI. Your primary goal is to assist users with their coding-related questions.
-You must strictly adhere to the following guidelines:
-1.  **Scope of Assistance:** Only answer questions directly related to programming, software development, algorithms, data structures, coding tools (IDEs, compilers, debuggers, version control), APIs, SDKs, and software architecture.
-2.  **Refusal for Off-Topic Questions:** If a user asks a question outside this scope (e.g., about history, biology, general knowledge, opinions, personal advice), you MUST politely refuse to answer. You can say something like: "I am a specialized coding assistant and cannot answer questions outside of programming topics." or "My apologies, but I'm programmed to assist with coding-related queries only." Do NOT attempt to answer off-topic questions.
-3.  **Accuracy and Clarity:** Provide accurate, clear, and concise explanations. If you provide code snippets, ensure they are correct and well-explained.
-4.  **No Personal Opinions:** Do not express personal opinions or engage in speculative discussions.
-5.  **Professional Tone:** Maintain a professional and helpful tone at all times.
-"""
-
-def ask_llm_basic(client: Groq, user_query: str, model: str = DEFAULT_MODEL):
+async def ask_llm_basic(client: AsyncGroq, user_query: str, model: str = DEFAULT_MODEL, use_cache: bool = True):
     """
     Sends a single user query to the LLM with a system prompt.
+    Streams the answer back, yielding text chunks as they arrive.
+    If the request fails (even partway through), STREAM_FAILED is yielded last.
+    With `use_cache`, repeated (or near-identical) queries are answered from the
+    local response cache without calling the API. Clearly off-topic queries are
+    refused locally, also without calling the API.
     """
     if not client:
         print("Groq client is not initialized.")
-        return None
+        return
+
+    # Obviously off-topic queries get the refusal without an API call
+    if looks_coding_related(user_query) is False:
+        yield OFF_TOPIC_REFUSAL
+        return
+
+    query_embedding = None
+    if use_cache:
+        cached_response, query_embedding = await get_response_cache().aget(model, CODING_ASSISTANT_SYSTEM_PROMPT, user_query)
+        if cached_response is not None:
+            yield cached_response
+            return
 
     messages = [
         {"role": "system", "content": CODING_ASSISTANT_SYSTEM_PROMPT},
@@ -31,42 +41,69 @@ def ask_llm_basic(client: Groq, user_query: str, model: str = DEFAULT_MODEL):
     ]
 
     try:
-        chat_completion = client.chat.completions.create(
+        stream = await client.chat.completions.create(
             messages=messages,
             model=model,
             temperature=0.7, # Controls randomness: lower is more deterministic
             max_tokens=1024, # Max length of the response
             top_p=1,         # Nucleus sampling
-            stream=False,    # We'll handle non-streaming for simplicity here
+            stream=True,     # Yield tokens as soon as the server produces them
         )
-        return chat_completion.choices[0].message.content
-    except APIError as e:
-        print(f"Groq API Error: {e}")
+        chunks = []
+        async for chunk in stream:
+            delta = chunk.choices[0].delta.content or ""
+            chunks.append(delta)
+            yield delta
     except RateLimitError as e:
         print(f"Groq Rate Limit Error: {e}")
+        yield STREAM_FAILED
+        return
+    except APIError as e:
+        print(f"Groq API Error: {e}")
+        yield STREAM_FAILED
+        return
     except Exception as e:
         print(f"An unexpected error occurred: {e}")
-    return None
+        yield STREAM_FAILED
+        return
+
+    # Only complete responses are cached. The answer has been streamed in full
+    # by now, so a failed cache write must not mark the stream as failed.
+    if use_cache:
+        try:
+            await get_response_cache().aset(
+                model, CODING_ASSISTANT_SYSTEM_PROMPT, user_query, "".join(chunks), embedding=query_embedding
+            )
+        except Exception as e:
+            print(f"Could not cache the response: {e}")
+
+async def collect_stream(stream):
+    """
+    Joins the chunks of a streamed response into the full string.
+    Returns None if nothing was streamed or the stream ended on an error,
+    rather than a truncated answer.
+    """
+    chunks = [chunk async for chunk in stream]
+    if not chunks or chunks[-1] is STREAM_FAILED:
+        return None
+    return "".join(chunks)
 
 if __name__ == "__main__":
     # Example usage:
-    # Ensure GROQ_API_KEY is set in your environment
-    # from your_module_1 import get_groq_client # Assuming get_groq_client is saved
-    # client = get_groq_client()
+    # Ensure GROQ_API_KEY is set in your environment.
+    # The shared client reuses one HTTP connection pool for all requests.
+    client = get_async_groq_client()
 
-    # For standalone testing, you can define get_groq_client here:
-    def get_groq_client_local():
-        api_key = os.environ.get("GROQ_API_KEY")
-        if not api_key: return None
-        return Groq(api_key=api_key)
-    client = get_groq_client_local()
-
-    if client:
+    async def main():
         question = "Explain what a list comprehension is in Python."
         # question = "What is the capital of France?" # To test refusal
-        response = ask_llm_basic(client, question)
-        if response:
-            print(f"User: {question}")
-            print(f"Assistant: {response}")
+        print(f"User: {question}")
+        print("Assistant: ", end="", flush=True)
+        async for chunk in ask_llm_basic(client, question):
+            print(chunk, end="", flush=True)
+        print()
+
+    if client:
+        asyncio.run(main())
     else:
         print("Failed to initialize Groq client. Cannot run example.")
@@ -0,0 +1,178 @@
+import os
+import asyncio
+import hashlib
+import logging
+import sqlite3
+import threading
+from collections import OrderedDict
+
+# The semantic (near-duplicate) tier needs fastembed and numpy.
+# Without them the cache still works, but only for exact repeats.
+try:
+    import numpy as np
+    from fastembed import TextEmbedding
+except ImportError:
+    np = None
+    TextEmbedding = None
+
+DEFAULT_CACHE_PATH = os.environ.get("LLM_CACHE_PATH", ".llm_cache.sqlite3")
+EMBEDDING_MODEL = "BAAI/bge-small-en-v1.5"
+SIMILARITY_THRESHOLD = 0.97
+
+# Hits are logged rather than printed: callers stream the answer to stdout
+_log = logging.getLogger("response_cache")
+
+
+class ResponseCache:
+    """
+    Two-tier cache for LLM responses, persisted in a SQLite file.
+    1. Exact: keyed on (model, system prompt, query), with an in-memory LRU in front of SQLite.
+    2. Semantic: on an exact miss, the query embedding is compared (cosine similarity)
+       with those of cached queries for the same model and system prompt, and a
+       cached response is reused if the similarity is at least `threshold`.
+    get()/set() block on the embedding model and SQLite; async code should use
+    aget()/aset(), which run them in a worker thread.
+    """
+
+    def __init__(self, path: str = DEFAULT_CACHE_PATH, maxsize: int = 1024, threshold: float = SIMILARITY_THRESHOLD):
+        self.maxsize = maxsize
+        self.threshold = threshold
+        self._memory = OrderedDict()
+        self._embedder = None
+        self._vectors = {} # namespace -> (key_hashes, embedding matrix)
+        # aget()/aset() use worker threads, so the connection is shared across
+        # threads and the lock guards it along with the in-memory state.
+        self._lock = threading.Lock()
+        self._embedder_lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key_hash TEXT PRIMARY KEY, namespace TEXT NOT NULL, embedding BLOB, response TEXT NOT NULL)"
+        )
+        self._db.commit()
+
+    @staticmethod
+    def _namespace(model: str, system_prompt: str) -> str:
+        return hashlib.sha256(f"{model}\0{system_prompt}".encode()).hexdigest()
+
+    @staticmethod
+    def _key_hash(namespace: str, query: str) -> str:
+        return hashlib.sha256(f"{namespace}\0{query}".encode()).hexdigest()
+
+    def _embed(self, text: str):
+        """Returns the normalized embedding of `text`, or None if embeddings are unavailable."""
+        if TextEmbedding is None:
+            return None
+        with self._embedder_lock:
+            if self._embedder is None:
+                # Loading (and on first use, downloading) the model is slow,
+                # so only do it the first time it's needed
+                self._embedder = TextEmbedding(model_name=EMBEDDING_MODEL)
+        vector = np.asarray(next(iter(self._embedder.embed([text]))), dtype=np.float32)
+        return vector / np.linalg.norm(vector)
+
+    def _load_vectors(self, namespace: str):
+        """Loads (once) the cached query embeddings for a namespace into a matrix."""
+        if namespace not in self._vectors:
+            rows = self._db.execute(
+                "SELECT key_hash, embedding FROM responses WHERE namespace = ? AND embedding IS NOT NULL",
+                (namespace,),
+            ).fetchall()
+            keys = [row[0] for row in rows]
+            matrix = (
+                np.vstack([np.frombuffer(row[1], dtype=np.float32) for row in rows])
+                if rows else np.empty((0, 0), dtype=np.float32)
+            )
+            self._vectors[namespace] = (keys, matrix)
+        return self._vectors[namespace]
+
+    def _remember(self, key_hash: str, response: str):
+        self._memory[key_hash] = response
+        self._memory.move_to_end(key_hash)
+        if len(self._memory) > self.maxsize:
+            self._memory.popitem(last=False)
+
+    def _lookup(self, key_hash: str):
+        if key_hash in self._memory:
+            self._memory.move_to_end(key_hash)
+            return self._memory[key_hash]
+        row = self._db.execute("SELECT response FROM responses WHERE key_hash = ?", (key_hash,)).fetchone()
+        if row is None:
+            return None
+        self._remember(key_hash, row[0])
+        return row[0]
+
+    def get(self, model: str, system_prompt: str, query: str, semantic: bool = True):
+        """
+        Looks up the query and returns (response, embedding).
+        `response` is the cached response, or None on a miss. `embedding` is the
+        query embedding if the semantic lookup computed one (else None); pass it
+        to set() on a miss so the query isn't embedded twice.
+        Set `semantic=False` to only accept exact matches.
+        """
+        namespace = self._namespace(model, system_prompt)
+        with self._lock:
+            response = self._lookup(self._key_hash(namespace, query))
+        if response is not None:
+            _log.info("Exact hit")
+            return response, None
+        if not semantic:
+            return None, None
+
+        embedding = self._embed(query)
+        if embedding is None:
+            return None, None
+        with self._lock:
+            keys, matrix = self._load_vectors(namespace)
+            if not keys:
+                return None, embedding
+            similarities = matrix @ embedding
+            best = int(np.argmax(similarities))
+            if similarities[best] < self.threshold:
+                return None, embedding
+            response = self._lookup(keys[best])
+        _log.info("Semantic hit (similarity %.3f)", similarities[best])
+        return response, embedding
+
+    def set(self, model: str, system_prompt: str, query: str, response: str, semantic: bool = True, embedding=None):
+        """
+        Stores a response. With `semantic=True` the query embedding is stored too,
+        so that similar queries can reuse this response; `embedding` is the one
+        returned by get(), and is only computed here if it wasn't passed.
+        """
+        namespace = self._namespace(model, system_prompt)
+        key_hash = self._key_hash(namespace, query)
+        if not semantic:
+            embedding = None
+        elif embedding is None:
+            embedding = self._embed(query)
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO responses (key_hash, namespace, embedding, response) VALUES (?, ?, ?, ?)",
+                (key_hash, namespace, embedding.tobytes() if embedding is not None else None, response),
+            )
+            self._db.commit()
+            self._remember(key_hash, response)
+            if embedding is not None and namespace in self._vectors:
+                keys, matrix = self._vectors[namespace]
+                if key_hash not in keys:
+                    matrix = np.vstack([matrix, embedding]) if keys else embedding[np.newaxis, :]
+                    self._vectors[namespace] = (keys + [key_hash], matrix)
+
+    async def aget(self, model: str, system_prompt: str, query: str, semantic: bool = True):
+        """get() in a worker thread, so embedding and SQLite I/O don't block the event loop."""
+        return await asyncio.to_thread(self.get, model, system_prompt, query, semantic)
+
+    async def aset(self, model: str, system_prompt: str, query: str, response: str, semantic: bool = True, embedding=None):
+        """set() in a worker thread, so embedding and SQLite I/O don't block the event loop."""
+        await asyncio.to_thread(self.set, model, system_prompt, query, response, semantic, embedding)
+
+
+_default_cache = None
+
+def get_response_cache():
+    """Returns the process-wide response cache, creating it on first use."""
+    global _default_cache
+    if _default_cache is None:
+        _default_cache = ResponseCache()
+    return _default_cache